@@ -1,13 +1,24 @@
 # datab.py
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, text
+from sqlalchemy import create_engine, event, Column, Index, Integer, String, Float, DateTime, text
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
 from datetime import datetime
 import pandas as pd
+import logging
 import os
+import warnings
+
+logger = logging.getLogger(__name__)
+
+# e.g. DB_URL=sqlite:///file:ecom?mode=memory&cache=shared&uri=true keeps the whole DB in memory
+DB_URL = os.getenv('DB_URL', 'sqlite:///./ecommerce.db')
 
 Base = declarative_base()
 
+# Created once per engine in init_db; building a sessionmaker per request is wasted work
+SessionLocal = None
+
 # Define your SQLAlchemy models FIRST
 class ProductTotalSales(Base):
     __tablename__ = 'product_total_sales'
@@ -33,6 +44,12 @@ class ProductEligibility(Base):
     eligibility = Column(String)
     message = Column(String)
 
+# Secondary indexes for the item_id/date filters the generated SQL leans on;
+# the composite primary keys lead with the date column
+Index('ix_pts_item_date', ProductTotalSales.item_id, ProductTotalSales.date)
+Index('ix_pas_item_date', ProductAdSales.item_id, ProductAdSales.date)
+Index('ix_pe_item', ProductEligibility.item_id)
+
 # Define the MODEL_MAPPING after the class definitions
 MODEL_MAPPING = {
     'product_total_sales': ProductTotalSales,
@@ -40,31 +57,124 @@ MODEL_MAPPING = {
     'product_eligibility': ProductEligibility,
 }
 
+# Rows per read_csv chunk during CSV loads
+CSV_CHUNKSIZE = 100_000
+
+# read_csv options per table so the C parser emits typed columns in one pass
+SCHEMAS = {
+    'product_total_sales': {
+        'dtype': {'item_id': 'string'},
+        'parse_dates': ['date'],
+        'date_format': '%Y-%m-%d',
+    },
+    'product_ad_sales': {
+        'dtype': {'item_id': 'string'},
+        'parse_dates': ['date'],
+        'date_format': '%Y-%m-%d',
+    },
+    'product_eligibility': {
+        'dtype': {'item_id': 'string', 'eligibility': 'string', 'message': 'string'},
+        'parse_dates': ['eligibility_datetime_utc'],
+        'date_format': '%Y-%m-%d %H:%M:%S',
+    },
+}
+
+# Numeric columns and their target dtypes. They are coerced after reading rather
+# than typed in read_csv, so one malformed cell drops its row instead of the file
+NUMERIC_COLUMNS = {
+    'product_total_sales': {'total_sales': 'float64', 'total_units_ordered': 'Int64'},
+    'product_ad_sales': {'ad_sales': 'float64', 'impressions': 'Int64', 'ad_spend': 'float64',
+                         'clicks': 'Int64', 'units_sold': 'Int64'},
+}
+
+# Rows missing any of these columns are dropped before insert
+KEY_COLUMNS = {
+    'product_total_sales': ['date', 'total_sales', 'total_units_ordered'],
+    'product_ad_sales': ['date', 'ad_sales', 'impressions', 'ad_spend', 'clicks', 'units_sold'],
+    'product_eligibility': ['eligibility_datetime_utc'],
+}
+
+# Candidate formats tried, in order, before resorting to pandas' own inference
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%Y-%m-%dT%H:%M:%S%z')
+
+def detect_date_format(series):
+    """Returns the first DATE_FORMATS entry that parses a sample of the series, or None."""
+    sample = series.dropna().astype(str).head(100)
+    for fmt in DATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt)
+            return fmt
+        except (ValueError, TypeError):
+            pass
+    return None
+
+def parse_datetime_column(series, errors='coerce'):
+    """Vectorized pd.to_datetime that avoids pandas' per-element dateutil fallback when it can."""
+    fmt = detect_date_format(series)
+    if fmt is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            return pd.to_datetime(series, errors=errors)
+    return pd.to_datetime(series, format=fmt, errors=errors)
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """Applies WAL journaling and larger caches to every new SQLite connection."""
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-65536")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.close()
+
+def _is_memory_url(url):
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
 def init_db():
-    engine = create_engine('sqlite:///./ecommerce.db')
+    global SessionLocal
+    if _is_memory_url(DB_URL):
+        # Every pooled connection must share the one in-memory database the CSVs load into
+        engine = create_engine(
+            DB_URL,
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool
+        )
+    else:
+        engine = create_engine(
+            DB_URL,
+            connect_args={'check_same_thread': False},
+            pool_size=10
+        )
+    event.listen(engine, "connect", _set_sqlite_pragmas)
     Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
     print("\n--- Attempting to load CSV data ---")
-    load_data_from_csv(engine, 'product_total_sales', 'product_total_sales.csv')
-    load_data_from_csv(engine, 'product_ad_sales', 'product_ad_sales.csv')
-    load_data_from_csv(engine, 'product_eligibility', 'product_eligibility.csv')
+    rows_inserted = 0
+    rows_inserted += load_data_from_csv(engine, 'product_total_sales', 'product_total_sales.csv')
+    rows_inserted += load_data_from_csv(engine, 'product_ad_sales', 'product_ad_sales.csv')
+    rows_inserted += load_data_from_csv(engine, 'product_eligibility', 'product_eligibility.csv')
     print("--- CSV data load attempts complete ---\n")
 
+    # Refresh planner statistics so SQLite actually picks the indexes above; only
+    # needed when a load changed the data, not on every startup
+    if rows_inserted:
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
     return engine
 
 def load_data_from_csv(engine, table_name, csv_file_name):
-    """Loads data from a CSV file into the specified database table."""
+    """Loads data from a CSV file into the specified database table and returns the rows inserted."""
     current_dir = os.path.dirname(os.path.abspath(__file__))
     csv_full_path = os.path.join(current_dir, 'data', csv_file_name)
 
     print(f"Checking for CSV: {csv_full_path}")
     if not os.path.exists(csv_full_path):
         print(f"ERROR: CSV file NOT FOUND at {csv_full_path}. Skipping data load for {table_name}.")
-        return
-
-    Session = sessionmaker(bind=engine)
-    session = Session()
+        return 0
 
+    rows_inserted = 0
     try:
         # Get the ModelClass from the MODEL_MAPPING dictionary
         ModelClass = MODEL_MAPPING.get(table_name)
@@ -72,80 +182,134 @@ def load_data_from_csv(engine, table_name, csv_file_name):
         if ModelClass is None:
             # This should ideally not happen if MODEL_MAPPING is correctly defined
             print(f"ERROR: Model class for table '{table_name}' not found in MODEL_MAPPING. Cannot check existing data.")
-            session.close() # Close session even on error
-            return
+            return 0
 
-        if session.query(ModelClass).count() > 0:
+        # A single-row probe is enough to know the table is populated; COUNT(*) scans it
+        with engine.connect() as conn:
+            has_data = conn.execute(text(f"SELECT 1 FROM {table_name} LIMIT 1")).first() is not None
+        if has_data:
             print(f"Table '{table_name}' already contains data. Skipping CSV load to prevent duplicates.")
-            session.close()
-            return
+            return 0
 
         print(f"Loading data from '{csv_file_name}' into '{table_name}'...")
-        df = pd.read_csv(csv_full_path)
-
-        # Your extensive print statements for debugging CSV content and dtypes:
-        print(f"Initial DataFrame for '{table_name}' (first 5 rows):\n{df.head().to_string()}")
-        print(f"Initial dtypes for '{table_name}':\n{df.dtypes}")
-
-        # --- Date/Datetime Conversion ---
-        if 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            if df['date'].isna().any():
-                print(f"Warning: Some 'date' values in '{table_name}' could not be parsed and were coerced to NaT. Dropping these rows.")
-            df.dropna(subset=['date'], inplace=True)
-
-        if 'eligibility_datetime_utc' in df.columns:
-            df['eligibility_datetime_utc'] = pd.to_datetime(df['eligibility_datetime_utc'], errors='coerce')
-            if df['eligibility_datetime_utc'].isna().any():
-                print(f"Warning: Some 'eligibility_datetime_utc' values in '{table_name}' could not be parsed and were coerced to NaT. Dropping these rows.")
-            df.dropna(subset=['eligibility_datetime_utc'], inplace=True)
-
-        # --- Numeric Column Conversion ---
-        numeric_cols = {
-            'product_total_sales': ['total_sales', 'total_units_ordered'],
-            'product_ad_sales': ['ad_sales', 'impressions', 'ad_spend', 'clicks', 'units_sold']
-        }
-
-        if table_name in numeric_cols:
-            for col in numeric_cols[table_name]:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                    if df[col].isna().any():
-                        print(f"Warning: Some '{col}' values in '{table_name}' could not be converted to numeric and were coerced to NaN. Dropping these rows.")
-                    df.dropna(subset=[col], inplace=True)
-                else:
-                    print(f"Warning: Expected numeric column '{col}' not found in '{table_name}' CSV.")
-
-        print(f"DataFrame for '{table_name}' after conversions and NaN drops (first 5 rows):\n{df.head().to_string()}")
-        print(f"Dtypes after conversions for '{table_name}':\n{df.dtypes}")
-        print(f"Number of rows remaining for '{table_name}' after cleaning: {len(df)}")
-
-        if not df.empty:
-            df.to_sql(table_name, con=engine, if_exists='append', index=False)
-            session.commit()
-            print(f"Successfully loaded data into '{table_name}'. Rows inserted: {len(df)}")
+
+        # All chunks share one transaction, so a failure part-way leaves the table
+        # empty for the next startup to retry instead of half-loaded
+        conn = engine.raw_connection()
+        cur = conn.cursor()
+        try:
+            # Skip fsyncs for the one-shot load; the connection goes back to NORMAL afterwards
+            cur.execute("PRAGMA synchronous=OFF")
+            cur.execute("BEGIN")
+            # Stream the file so peak memory is bounded by CSV_CHUNKSIZE, not the file size
+            for chunk in pd.read_csv(csv_full_path, chunksize=CSV_CHUNKSIZE, **SCHEMAS[table_name]):
+                chunk = _clean(chunk, table_name)
+                if chunk.empty:
+                    continue
+                bulk_insert(cur, table_name, chunk)
+                rows_inserted += len(chunk)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.close()
+            conn.close()
+
+        if rows_inserted:
+            print(f"Successfully loaded data into '{table_name}'. Rows inserted: {rows_inserted}")
         else:
             print(f"No valid data to load for '{table_name}' after processing CSV (DataFrame is empty).")
 
     except Exception as e:
-        session.rollback()
         print(f"CRITICAL ERROR loading data for '{table_name}' from '{csv_file_name}': {e}")
-    finally:
-        session.close()
+        return 0
+
+    return rows_inserted
+
+def _clean(df, table_name):
+    """Applies the per-table conversions and NaN drops to one chunk and returns it."""
+    schema = SCHEMAS[table_name]
+
+    # Formatting frames is expensive, so only build the dumps when someone will read them
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Initial DataFrame for '%s' (first 5 rows):\n%s", table_name, df.head().to_string())
+        logger.debug("Initial dtypes for '%s':\n%s", table_name, df.dtypes)
+
+    # read_csv leaves a date column as object if any value fails to parse; the
+    # known format still applies to the rest, so coerce with it rather than re-detecting
+    for col in schema['parse_dates']:
+        if not pd.api.types.is_datetime64_any_dtype(df[col]):
+            logger.warning("Some '%s' values in '%s' could not be parsed and will be coerced to NaT.", col, table_name)
+            df[col] = pd.to_datetime(df[col], format=schema['date_format'], errors='coerce')
+
+    numeric = {}
+    for col, dtype in NUMERIC_COLUMNS.get(table_name, {}).items():
+        if col in df.columns:
+            numeric[col] = dtype
+        else:
+            logger.warning("Expected numeric column '%s' not found in '%s' CSV.", col, table_name)
+
+    # Coerce every numeric column in one pass, then drop bad rows with a single dropna
+    cols = list(numeric)
+    if cols:
+        df[cols] = df[cols].apply(pd.to_numeric, errors='coerce')
+        int_cols = [col for col in cols if numeric[col] == 'Int64']
+        if int_cols:
+            # Fractional values can't be cast to an integer column; treat them as invalid
+            df[int_cols] = df[int_cols].mask(df[int_cols] % 1 != 0)
 
-def get_session(engine):
-    Session = sessionmaker(bind=engine)
-    return Session()
+    # Missing numeric columns were reported above; read_csv already rejects a missing date column
+    key_cols = [col for col in KEY_COLUMNS[table_name] if col in df.columns]
+
+    # The row delta from dropna is the invalid-row count; no separate isna() pass needed
+    before = len(df)
+    df = df.dropna(how='any', subset=key_cols).astype(numeric)
+    dropped = before - len(df)
+    if dropped:
+        logger.warning("Dropped %d rows with invalid %s in '%s'", dropped, ", ".join(key_cols), table_name)
+
+    if debug:
+        logger.debug("DataFrame for '%s' after conversions and NaN drops (first 5 rows):\n%s", table_name, df.head().to_string())
+        logger.debug("Dtypes after conversions for '%s':\n%s", table_name, df.dtypes)
+    logger.debug("Number of rows remaining for '%s' after cleaning: %d", table_name, len(df))
+
+    return df
+
+def _to_records(df):
+    """Converts a DataFrame into plain tuples the sqlite3 driver can bind directly."""
+    df = df.copy()
+    for col in df.select_dtypes(include=['datetime', 'datetimetz']).columns:
+        # Match the storage format SQLAlchemy's DateTime type uses on SQLite
+        df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    df = df.astype(object).where(df.notna(), None)
+    return df.itertuples(index=False, name=None)
+
+def bulk_insert(cur, table_name, df):
+    """Inserts a DataFrame with one executemany on the caller's cursor, bypassing the ORM.
+
+    The caller owns the transaction, so every chunk of a load commits or rolls back together.
+    """
+    cols = ", ".join(df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    cur.executemany(
+        f"INSERT INTO {table_name} ({cols}) VALUES ({placeholders})",
+        _to_records(df)
+    )
+
+def get_session(engine=None):
+    if SessionLocal is None:
+        raise RuntimeError("init_db() must be called before get_session()")
+    return SessionLocal()
 
 if __name__ == '__main__':
     print("Initializing database and attempting to load CSV data...")
     init_db()
     print("Database initialization complete. Verifying data counts:")
 
-    engine = create_engine('sqlite:///./ecommerce.db')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    try:
+    with get_session() as session:
         print("\nVerifying data in product_total_sales:")
         result = session.execute(text("SELECT COUNT(*) FROM product_total_sales;"))
         count = result.scalar_one()
@@ -160,6 +324,3 @@ if __name__ == '__main__':
         result = session.execute(text("SELECT COUNT(*) FROM product_eligibility;"))
         count = result.scalar_one()
         print(f"product_eligibility has {count} rows.")
-
-    finally:
-        session.close()
\ No newline at end of file
@@ -1,8 +1,13 @@
+import asyncio
 import google.generativeai as genai
+import hashlib
+import json
 import os
 import re
+import threading
+from functools import lru_cache
 from dotenv import load_dotenv
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, Mapping, Optional, Tuple
 import logging
 
 # Set up logging
@@ -14,7 +19,39 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Compiled once; _clean_sql_response runs on every request
+_COMMENT_RE = re.compile(r'--.*$', re.MULTILINE)
+_WS_RE = re.compile(r'\s+')
+_FENCE_RE = re.compile(r'^```(?:json|sql)?\s*|\s*```$')
+
+FORMAT_GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "max_output_tokens": 2000,
+    "top_p": 0.95
+}
+
+# Results above this many rows are formatted fresh each time instead of being cached
+FORMAT_CACHE_MAX_ROWS = 50
+
+class _CacheKey:
+    """Hashes and compares on `key` only, so lru_cache ignores the payload carried in `value`"""
+    __slots__ = ("key", "value")
+
+    def __init__(self, key: Any, value: Any):
+        self.key = key
+        self.value = value
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, _CacheKey) and self.key == other.key
+
 class LLMHelper:
+    # genai.list_models() is a network call; share its result across instances
+    _MODELS_CACHE: Optional[Dict[str, Any]] = None
+    _MODELS_LOCK = threading.Lock()
+
     def __init__(self, model_name: str = "models/gemini-1.5-flash"):
         """
         Initialize the Gemini model with robust error handling
@@ -24,6 +61,7 @@ class LLMHelper:
         """
         self.model_name = model_name
         self.model = None
+        self._schemas: Dict[str, str] = {}
         self.available_models = self._get_available_models()
         
         try:
@@ -50,23 +88,39 @@ class LLMHelper:
             logger.error(f"Failed to initialize Gemini: {str(e)}")
             raise RuntimeError(f"LLM initialization failed: {str(e)}")
 
-    def _get_available_models(self) -> Dict[str, Any]:
-        """Get all available models that support generateContent"""
-        try:
-            return {
-                m.name: {
-                    "name": m.name,
-                    "description": m.description,
-                    "input_token_limit": m.input_token_limit,
-                    "output_token_limit": m.output_token_limit,
-                    "supported_methods": m.supported_generation_methods
+    @classmethod
+    def _get_available_models(cls, refresh: bool = False) -> Dict[str, Any]:
+        """
+        Get all available models that support generateContent, cached for the process lifetime
+        
+        Args:
+            refresh: Re-fetch the model list even if it is already cached
+            
+        Returns:
+            Mapping of model name to model details (empty if the fetch failed)
+        """
+        with cls._MODELS_LOCK:
+            if cls._MODELS_CACHE is not None and not refresh:
+                return cls._MODELS_CACHE
+            try:
+                models = {
+                    m.name: {
+                        "name": m.name,
+                        "description": m.description,
+                        "input_token_limit": m.input_token_limit,
+                        "output_token_limit": m.output_token_limit,
+                        "supported_methods": m.supported_generation_methods
+                    }
+                    for m in genai.list_models() 
+                    if 'generateContent' in m.supported_generation_methods
                 }
-                for m in genai.list_models() 
-                if 'generateContent' in m.supported_generation_methods
-            }
-        except Exception as e:
-            logger.error(f"Error fetching available models: {str(e)}")
-            return {}
+            except Exception as e:
+                logger.error(f"Error fetching available models: {str(e)}")
+                return {}
+            # Only cache a successful fetch so a transient failure can be retried
+            if models:
+                cls._MODELS_CACHE = models
+            return models
 
     def _clean_sql_response(self, sql: str) -> str:
         """
@@ -85,10 +139,10 @@ class LLMHelper:
             sql = sql[3:-3].strip()
         
         # Remove any remaining line comments
-        sql = re.sub(r'--.*$', '', sql, flags=re.MULTILINE)
+        sql = _COMMENT_RE.sub('', sql)
         
-        # Remove excessive whitespace
-        sql = ' '.join(sql.split())
+        # Collapse whitespace runs in a single pass
+        sql = _WS_RE.sub(' ', sql).strip()
         
         # Ensure it ends with semicolon
         if not sql.endswith(';'):
@@ -96,61 +150,110 @@ class LLMHelper:
             
         return sql.strip()
 
-    def generate_sql_query(self, question: str, schema_info: str) -> str:
+    def _parse_sql_response(self, raw: str) -> Tuple[str, Dict[str, Any]]:
         """
-        Generate SQL query from natural language question with strict formatting
+        Split the model's JSON reply into a cleaned SQL string and its bind parameters
+        
+        Args:
+            raw: Raw response from the model, ideally {"sql": ..., "params": {...}}
+            
+        Returns:
+            Tuple of (cleaned SQL query, bind parameters); a plain SQL reply gets no params
+        """
+        try:
+            payload = json.loads(_FENCE_RE.sub('', raw.strip()))
+            sql, params = payload["sql"], payload.get("params") or {}
+            if not isinstance(sql, str) or not isinstance(params, dict):
+                raise ValueError("Unexpected JSON shape")
+        except (ValueError, KeyError, TypeError):
+            sql, params = raw, {}
+        return self._clean_sql_response(sql.strip()), params
+
+    def generate_sql_query(self, question: str, schema_info: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Generate a parameterized SQL query from natural language question with strict formatting
         
         Args:
             question: Natural language question
             schema_info: Database schema information
             
         Returns:
-            Generated SQL query or error message
+            Tuple of (SQL query, bind parameters), or (error message, {}) on failure
+        """
+        schema_hash = hashlib.sha256(schema_info.encode()).hexdigest()
+        self._schemas.setdefault(schema_hash, schema_info)
+
+        try:
+            # Only whitespace is normalized for the key: case carries into the bound
+            # literals, and SQLite compares TEXT case-sensitively
+            key = _CacheKey(' '.join(question.split()), question)
+            sql, params = self._generate_sql_cached(key, schema_hash)
+            # Hand out a copy so callers can't mutate the cached entry
+            return sql, dict(params)
+        except Exception as e:
+            error_msg = f"Error generating SQL: {str(e)}"
+            logger.error(error_msg)
+            return error_msg, {}
+
+    async def agenerate_sql_query(self, question: str, schema_info: str) -> Tuple[str, Dict[str, Any]]:
+        """Non-blocking generate_sql_query: runs in the default executor and shares its cache"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.generate_sql_query, question, schema_info)
+
+    @lru_cache(maxsize=1024)
+    def _generate_sql_cached(self, question_key: _CacheKey, schema_hash: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Call Gemini for a (question, schema) pair; failures raise so they are never cached
+        
+        Args:
+            question_key: Normalized question as the key, original question as the value
+            schema_hash: sha256 of the schema text registered in self._schemas
+            
+        Returns:
+            Tuple of (cleaned SQL query, bind parameters)
         """
+        question = question_key.value
+        schema_info = self._schemas[schema_hash]
         prompt = f"""You are an expert SQLite SQL developer. Follow these rules exactly:
         1. Given these tables:
         {schema_info}
         2. Convert this question to SQL: "{question}"
-        3. Return ONLY the pure SQL query without:
+        3. Replace every literal value taken from the question (item ids, dates, thresholds)
+           with a named placeholder such as :item_id or :start_date
+        4. Return ONLY a JSON object of the form {{"sql": "<query>", "params": {{"<name>": <value>}}}} without:
            - Markdown code blocks
            - Explanations
-           - Any text besides the SQL
-        4. Use SQLite compatible syntax
-        5. Never use backticks or code formatting
-        6. Ensure the query ends with a semicolon
+           - Any text besides the JSON
+        5. Use SQLite compatible syntax
+        6. Never use backticks or code formatting
+        7. Ensure the query ends with a semicolon
         
-        SQL Query:"""
+        JSON:"""
         
-        try:
-            if not self.model:
-                raise RuntimeError("Model not initialized")
-                
-            response = self.model.generate_content(
-                prompt,
-                generation_config={
-                    "temperature": 0.1,
-                    "max_output_tokens": 1000,
-                    "top_p": 0.95
-                },
-                safety_settings={
-                    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-                    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
-                    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
-                    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'
-                }
-            )
+        if not self.model:
+            raise RuntimeError("Model not initialized")
             
-            if not response.text:
-                raise ValueError("Empty response from model")
-                
-            cleaned_sql = self._clean_sql_response(response.text)
-            logger.debug(f"Generated SQL: {cleaned_sql}")
-            return cleaned_sql
+        response = self.model.generate_content(
+            prompt,
+            generation_config={
+                "temperature": 0.1,
+                "max_output_tokens": 1000,
+                "top_p": 0.95
+            },
+            safety_settings={
+                'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
+                'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
+                'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
+                'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'
+            }
+        )
+        
+        if not response.text:
+            raise ValueError("Empty response from model")
             
-        except Exception as e:
-            error_msg = f"Error generating SQL: {str(e)}"
-            logger.error(error_msg)
-            return error_msg
+        cleaned_sql, params = self._parse_sql_response(response.text)
+        logger.debug(f"Generated SQL: {cleaned_sql} params: {params}")
+        return cleaned_sql, params
 
     def format_response(self, question: str, data: Any) -> str:
         """
@@ -163,7 +266,72 @@ class LLMHelper:
         Returns:
             Formatted response or error message
         """
-        prompt = f"""Format this data into a professional business report for: "{question}"
+        trivial = self._guarded_trivial_response(data)
+        if trivial is not None:
+            return trivial
+
+        try:
+            key = self._data_cache_key(data)
+            if key is not None:
+                return self._format_response_cached(question, _CacheKey(key, data))
+            return self._format_response_uncached(question, data)
+        except Exception as e:
+            return self._format_error(e)
+
+    async def aformat_response(self, question: str, data: Any) -> str:
+        """Non-blocking format_response: runs in the default executor and shares its cache"""
+        trivial = self._guarded_trivial_response(data)
+        if trivial is not None:
+            return trivial
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.format_response, question, data)
+
+    @staticmethod
+    def _format_error(e: Exception) -> str:
+        """Log and return the error message every format entry point hands back"""
+        error_msg = f"Error formatting response: {str(e)}"
+        logger.error(error_msg)
+        return error_msg
+
+    def _guarded_trivial_response(self, data: Any) -> Optional[str]:
+        """_trivial_response for the sync, async and streaming paths; unexpected data shapes
+        get the same error message instead of escaping"""
+        try:
+            return self._trivial_response(data)
+        except Exception as e:
+            return self._format_error(e)
+
+    @staticmethod
+    def _trivial_response(data: Any) -> Optional[str]:
+        """Answer empty and single-value results directly, without a Gemini round-trip"""
+        if not data:
+            return "No data found for that query."
+        if isinstance(data, list) and len(data) == 1 and isinstance(data[0], Mapping) and len(data[0]) == 1:
+            key, val = next(iter(data[0].items()))
+            return f"{key}: {val}"
+        return None
+
+    @staticmethod
+    def _data_cache_key(data: Any) -> Optional[Tuple]:
+        """Build a hashable key for small lists of rows, or None if the data should not be cached"""
+        if not isinstance(data, list) or len(data) > FORMAT_CACHE_MAX_ROWS:
+            return None
+        try:
+            key = tuple(tuple(sorted(row.items())) for row in data)
+            hash(key)
+            return key
+        except (AttributeError, TypeError):
+            return None
+
+    @lru_cache(maxsize=1024)
+    def _format_response_cached(self, question: str, rows_key: _CacheKey) -> str:
+        """Cached wrapper around _format_response_uncached; hashes on the rows' sorted items
+        but formats the original rows, so the prompt keeps the query's column order"""
+        return self._format_response_uncached(question, rows_key.value)
+
+    def _format_prompt(self, question: str, data: Any) -> str:
+        """Build the report-formatting prompt shared by the blocking and streaming paths"""
+        return f"""Format this data into a professional business report for: "{question}"
         Data: {data}
         
         Guidelines:
@@ -175,29 +343,50 @@ class LLMHelper:
         6. Use professional business language
         
         Formatted Answer:"""
+
+    def _format_response_uncached(self, question: str, data: Any) -> str:
+        """Call Gemini to format data; failures raise so they are never cached"""
+        if not self.model:
+            raise RuntimeError("Model not initialized")
+            
+        response = self.model.generate_content(
+            self._format_prompt(question, data),
+            generation_config=FORMAT_GENERATION_CONFIG
+        )
         
-        try:
-            if not self.model:
-                raise RuntimeError("Model not initialized")
-                
-            response = self.model.generate_content(
-                prompt,
-                generation_config={
-                    "temperature": 0.3,
-                    "max_output_tokens": 2000,
-                    "top_p": 0.95
-                }
-            )
+        if not response.text:
+            raise ValueError("Empty response from model")
             
-            if not response.text:
-                raise ValueError("Empty response from model")
-                
-            return response.text.strip()
+        return response.text.strip()
+
+    async def stream_format_response(self, question: str, data: Any) -> AsyncIterator[str]:
+        """
+        Stream the formatted response as Gemini produces it
+        
+        Args:
+            question: Original question
+            data: Data to format (can be list/dict/str)
             
-        except Exception as e:
-            error_msg = f"Error formatting response: {str(e)}"
-            logger.error(error_msg)
-            return error_msg
+        Yields:
+            Text chunks in the order they arrive; errors propagate to the caller
+        """
+        trivial = self._guarded_trivial_response(data)
+        if trivial is not None:
+            yield trivial
+            return
+
+        if not self.model:
+            raise RuntimeError("Model not initialized")
+            
+        response = await self.model.generate_content_async(
+            self._format_prompt(question, data),
+            generation_config=FORMAT_GENERATION_CONFIG,
+            stream=True
+        )
+        
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
 
     def get_model_info(self) -> Dict[str, Any]:
         """Get detailed information about the current model"""
@@ -1,24 +1,35 @@
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from database import ProductTotalSales, ProductAdSales, ProductEligibility
+from datab import parse_datetime_column
+
+# Bound parameters per statement on SQLite >= 3.32; multi-row INSERTs must stay under it
+SQLITE_MAX_VARIABLES = 32766
+
+def replace_table(conn, name, df):
+    """Drops and reloads a table with multi-row INSERTs on an open transaction."""
+    conn.execute(text(f'DROP TABLE IF EXISTS {name}'))
+    df.to_sql(name, conn, if_exists='replace', index=False, method='multi',
+              chunksize=max(1, min(10_000, SQLITE_MAX_VARIABLES // len(df.columns))))
 
 def load_data():
     engine = create_engine('sqlite:///ecommerce.db')
     
     # Load and transform data (replace with your actual file paths)
-    total_sales_df = pd.read_csv('product_total_sales.csv')
-    ad_sales_df = pd.read_csv('product_ad_sales.csv')
-    eligibility_df = pd.read_csv('product_eligibility.csv')
+    total_sales_df = pd.read_csv('product_total_sales.csv', engine='pyarrow')
+    ad_sales_df = pd.read_csv('product_ad_sales.csv', engine='pyarrow')
+    eligibility_df = pd.read_csv('product_eligibility.csv', engine='pyarrow')
     
     # Convert date columns
-    total_sales_df['date'] = pd.to_datetime(total_sales_df['date'])
-    ad_sales_df['date'] = pd.to_datetime(ad_sales_df['date'])
-    eligibility_df['eligibility_datetime_utc'] = pd.to_datetime(eligibility_df['eligibility_datetime_utc'])
+    total_sales_df['date'] = parse_datetime_column(total_sales_df['date'], errors='raise')
+    ad_sales_df['date'] = parse_datetime_column(ad_sales_df['date'], errors='raise')
+    eligibility_df['eligibility_datetime_utc'] = parse_datetime_column(eligibility_df['eligibility_datetime_utc'], errors='raise')
     
-    # Load data to SQL
-    total_sales_df.to_sql('product_total_sales', engine, if_exists='replace', index=False)
-    ad_sales_df.to_sql('product_ad_sales', engine, if_exists='replace', index=False)
-    eligibility_df.to_sql('product_eligibility', engine, if_exists='replace', index=False)
+    # Load data to SQL in one transaction so chunks don't each pay a commit
+    with engine.begin() as conn:
+        replace_table(conn, 'product_total_sales', total_sales_df)
+        replace_table(conn, 'product_ad_sales', ad_sales_df)
+        replace_table(conn, 'product_eligibility', eligibility_df)
 
 if __name__ == '__main__':
     load_data()
\ No newline at end of file
@@ -3,16 +3,21 @@ import os
 
 load_dotenv()
 
+import matplotlib
+matplotlib.use('Agg')  # Headless backend; charts are only ever rendered to PNG buffers
+
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from database import init_db, get_session
+from datab import init_db, get_session
 from llm_helper import LLMHelper
 from sqlalchemy import text
+import asyncio
 import io
-import matplotlib.pyplot as plt
+import matplotlib.style
+from matplotlib.figure import Figure
 import pandas as pd
 import uvicorn
 from typing import Optional
@@ -29,6 +34,9 @@ app = FastAPI(
 engine = init_db()
 llm_helper = LLMHelper() # This should now correctly find the GOOGLE_API_KEY
 
+# Set once at import instead of mutating global style state on every request
+matplotlib.style.use('ggplot')
+
 # Schema information for the LLM
 SCHEMA_INFO = """
 Tables:
@@ -37,6 +45,17 @@ Tables:
 3. product_eligibility: eligibility_datetime_utc (DateTime), item_id (String), eligibility (String), message (String)
 """
 
+def _fetch_rows(sql_query: str, sql_params: Dict) -> List:
+    """Run a query on a pooled session and return its rows as mappings"""
+    with get_session() as session:
+        return session.execute(text(sql_query), sql_params).mappings().all()
+
+def _fetch_frame(sql_query: str, sql_params: Dict) -> pd.DataFrame:
+    """Run a query on a pooled session and return its rows as a DataFrame"""
+    with get_session() as session:
+        result = session.execute(text(sql_query), sql_params)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
 @app.get("/")
 async def root():
     """Root endpoint with API documentation"""
@@ -69,26 +88,23 @@ async def answer_question(question: str):
     """Main endpoint for answering questions"""
     try:
         # Generate SQL query
-        sql_query = llm_helper.generate_sql_query(question, SCHEMA_INFO)
+        sql_query, sql_params = await llm_helper.agenerate_sql_query(question, SCHEMA_INFO)
         if sql_query.startswith("Error"):
             raise HTTPException(status_code=400, detail=sql_query)
 
-        # Execute query
-        session = get_session(engine)
-        try:
-            result = session.execute(text(sql_query))
-            rows = [dict(row) for row in result.mappings()]
-        finally:
-            session.close()
+        # Execute query off the event loop
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(None, _fetch_rows, sql_query, sql_params)
 
         # Format response
-        formatted_response = llm_helper.format_response(question, rows)
+        formatted_response = await llm_helper.aformat_response(question, rows)
         if formatted_response.startswith("Error"):
             raise HTTPException(status_code=400, detail=formatted_response)
 
         return {
             "question": question,
             "sql_query": sql_query,
+            "sql_params": sql_params,
             "answer": formatted_response,
             "data": rows
         }
@@ -101,99 +117,85 @@ async def answer_question(question: str):
 @app.get("/query/stream")
 async def answer_question_stream(question: str):
     """Streaming version of the query endpoint"""
-    def generate():
+    async def generate():
         try:
             # Generate SQL query
-            sql_query = llm_helper.generate_sql_query(question, SCHEMA_INFO)
+            sql_query, sql_params = await llm_helper.agenerate_sql_query(question, SCHEMA_INFO)
             if sql_query.startswith("Error"):
                 yield f"Error: {sql_query}\n"
                 return
 
-            yield f"Generated SQL: {sql_query}\n\n"
+            yield f"Generated SQL: {sql_query}\nParameters: {sql_params}\n\n"
 
-            # Execute query
-            session = get_session(engine)
-            try:
-                result = session.execute(text(sql_query))
-                rows = [dict(row) for row in result.mappings()]
-            finally:
-                session.close()
+            # Execute query off the event loop
+            loop = asyncio.get_running_loop()
+            rows = await loop.run_in_executor(None, _fetch_rows, sql_query, sql_params)
 
-            # Format and stream response
-            formatted_response = llm_helper.format_response(question, rows)
-            if formatted_response.startswith("Error"):
-                yield f"Error: {formatted_response}\n"
-                return
-
-            for word in formatted_response.split():
-                yield word + " "
-                import time
-                time.sleep(0.05)  # Simulate typing
+            # Stream the formatted response as the model produces it
+            async for chunk in llm_helper.stream_format_response(question, rows):
+                yield chunk
 
         except Exception as e:
             yield f"Error: {str(e)}\n"
 
     return StreamingResponse(generate(), media_type="text/plain")
 
+def _render_chart(df: pd.DataFrame, chart_type: Optional[str], question: str) -> io.BytesIO:
+    """Render the query result to a PNG buffer without touching pyplot's global state"""
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+
+    # Determine chart type automatically if not specified
+    if not chart_type:
+        if 'date' in df.columns and len(df) > 3:
+            chart_type = 'line'
+        elif len(df) <= 10:
+            chart_type = 'bar'
+        else:
+            chart_type = 'histogram'
+
+    # Generate appropriate chart
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'])
+        df = df.sort_values('date')
+
+        if chart_type == 'line':
+            for col in df.select_dtypes(include=['number']).columns:
+                if col != 'date':
+                    ax.plot(df['date'], df[col], label=col)
+            ax.legend()
+        elif chart_type == 'bar':
+            df.plot(x='date', y=df.select_dtypes(include=['number']).columns[0], kind='bar', ax=ax)
+    else:
+        x = df.columns[0]
+        if chart_type == 'bar':
+            df.plot(x=x, y=df.columns[1], kind='bar', ax=ax)
+        elif chart_type == 'pie':
+            ax.pie(df[df.columns[1]], labels=df[x], autopct='%1.1f%%')
+
+    ax.set_title(f"Visualization: {question[:50]}...")
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+
+    # Save to buffer
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=100)
+    buf.seek(0)
+    return buf
+
 @app.get("/query/visualize")
 async def visualize_data(question: str, chart_type: Optional[str] = None):
     """Endpoint for data visualization"""
     try:
         # Generate SQL query
-        sql_query = llm_helper.generate_sql_query(question, SCHEMA_INFO)
+        sql_query, sql_params = await llm_helper.agenerate_sql_query(question, SCHEMA_INFO)
         if sql_query.startswith("Error"):
             raise HTTPException(status_code=400, detail=sql_query)
 
-        # Execute query
-        session = get_session(engine)
-        try:
-            result = session.execute(text(sql_query))
-            df = pd.DataFrame([dict(row) for row in result.mappings()])
-        finally:
-            session.close()
-
-        # Create visualization
-        plt.figure(figsize=(10, 6))
-        plt.style.use('ggplot')
-
-        # Determine chart type automatically if not specified
-        if not chart_type:
-            if 'date' in df.columns and len(df) > 3:
-                chart_type = 'line'
-            elif len(df) <= 10:
-                chart_type = 'bar'
-            else:
-                chart_type = 'histogram'
-
-        # Generate appropriate chart
-        if 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date')
-            x = 'date'
-
-            if chart_type == 'line':
-                for col in df.select_dtypes(include=['number']).columns:
-                    if col != 'date':
-                        plt.plot(df['date'], df[col], label=col)
-                plt.legend()
-            elif chart_type == 'bar':
-                df.plot(x='date', y=df.select_dtypes(include=['number']).columns[0], kind='bar')
-        else:
-            x = df.columns[0]
-            if chart_type == 'bar':
-                df.plot(x=x, y=df.columns[1], kind='bar')
-            elif chart_type == 'pie':
-                plt.pie(df[df.columns[1]], labels=df[x], autopct='%1.1f%%')
-
-        plt.title(f"Visualization: {question[:50]}...")
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-
-        # Save to buffer
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        buf.seek(0)
-        plt.close()
+        # Execute query and render in worker threads so the event loop stays free
+        loop = asyncio.get_running_loop()
+        df = await loop.run_in_executor(None, _fetch_frame, sql_query, sql_params)
+        buf = await loop.run_in_executor(None, _render_chart, df, chart_type, question)
 
         return StreamingResponse(buf, media_type="image/png")
 
@@ -218,18 +220,16 @@ async def clean_answer(question: str):
     """Endpoint that returns only the clean answer"""
     try:
         # Generate SQL query
-        sql_query = llm_helper.generate_sql_query(question, SCHEMA_INFO)
+        sql_query, sql_params = await llm_helper.agenerate_sql_query(question, SCHEMA_INFO)
         if sql_query.startswith("Error"):
             return f"Error: {sql_query}"
 
-        # Execute query
-        session = get_session(engine)
-        result = session.execute(text(sql_query))
-        rows = [dict(row) for row in result.mappings()]
-        session.close()
+        # Execute query off the event loop
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(None, _fetch_rows, sql_query, sql_params)
 
         # Format response
-        formatted_response = llm_helper.format_response(question, rows)
+        formatted_response = await llm_helper.aformat_response(question, rows)
         return formatted_response
 
     except Exception as e:
@@ -249,6 +249,7 @@ async def html_answer(question: str):
                 <details>
                     <summary>Technical Details</summary>
                     <pre>SQL: {result['sql_query']}</pre>
+                    <pre>Parameters: {result['sql_params']}</pre>
                     <pre>Data: {result['data']}</pre>
                 </details>
             </body>